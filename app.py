@@ -1,11 +1,13 @@
 import streamlit as st
 import os
-from utils.pdf_processor import extract_text_from_pdf, chunk_text
-from utils.embeddings import create_embeddings, create_vector_store
-from utils.chain_setup import setup_conversational_chain
-from utils.pdf_diagnostic import analyze_pdf, extract_images_from_pdf
+from utils.pdf_processor import scan_pdf, extract_text_with_ocr, chunk_text
+from utils.pdf_diagnostic import extract_images_from_pdf
+from utils.embeddings import create_embeddings, create_vector_store, load_cached_vector_store, save_vector_store
+from utils.chain_setup import load_llm, setup_conversational_chain, condense_question, answer_question
+from utils.semantic_cache import create_qa_cache, lookup_answer, store_answer
 from langchain.docstore.document import Document
 import tempfile
+import hashlib
 from PIL import Image
 
 # Page configuration
@@ -30,6 +32,8 @@ if "pdf_analysis" not in st.session_state:
     st.session_state.pdf_analysis = None
 if "sample_images" not in st.session_state:
     st.session_state.sample_images = []
+if "qa_cache" not in st.session_state:
+    st.session_state.qa_cache = create_qa_cache()
 
 # Sidebar for file upload
 with st.sidebar:
@@ -55,72 +59,121 @@ with st.sidebar:
         st.session_state.processed = False
         st.session_state.pdf_analysis = None
         st.session_state.sample_images = []
+        st.session_state.ocr_used = False
+        st.session_state.qa_cache = create_qa_cache()
         
-        # Analyze PDF first
-        if show_diagnostics:
-            with st.spinner("Analyzing PDF structure..."):
-                st.session_state.pdf_analysis = analyze_pdf(uploaded_file)
-                uploaded_file.seek(0)  # Reset file pointer
+        # Stream the upload to a single temporary file shared by every step,
+        # hashing it on the way to key the on-disk index cache
+        file_hash = hashlib.sha256()
+        uploaded_file.seek(0)
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+            for block in iter(lambda: uploaded_file.read(1 << 20), b""):
+                file_hash.update(block)
+                tmp_file.write(block)
+            tmp_path = tmp_file.name
+        pdf_key = file_hash.hexdigest()
         
-        # Extract sample images for problematic PDFs
-        if (st.session_state.pdf_analysis and 
-            st.session_state.pdf_analysis["has_images"] and 
-            not st.session_state.pdf_analysis["has_text"]):
-            with st.spinner("Extracting sample images..."):
-                st.session_state.sample_images = extract_images_from_pdf(uploaded_file, max_pages=2)
-                uploaded_file.seek(0)
-        
-        # Process PDF
-        with st.spinner("Processing PDF..."):
-            try:
-                # Extract text from PDF
-                text = extract_text_from_pdf(uploaded_file)
+        try:
+            # Reuse the index built for an identical upload, skipping extraction entirely
+            with st.spinner("Checking for a previously processed copy..."):
+                vector_store, cache_metadata = load_cached_vector_store(pdf_key, create_embeddings())
+            
+            if vector_store is not None:
+                st.info("This PDF was processed before - reusing its saved index")
+                st.session_state.vector_store = vector_store
+                st.session_state.ocr_used = cache_metadata.get("ocr_used", False)
                 
-                if not text.strip():
-                    st.error("Could not extract text from PDF using any method.")
-                    st.info("This PDF may be: 1) Password protected 2) Pure images without text 3) Malformed")
-                    
-                    # Show manual workaround
-                    with st.expander("Manual Workaround Options"):
-                        st.markdown("""
-                        If automatic extraction fails, you can:
-                        1. **Convert PDF to text**: Use Adobe Acrobat or online tools
-                        2. **Copy text manually**: Select text and copy-paste
-                        3. **Use alternative OCR**: Try Google Drive or other OCR services
-                        4. **Check if PDF is protected**: Some PDFs restrict text extraction
-                        """)
-                else:
-                    # Display text extraction stats
-                    char_count = len(text)
-                    word_count = len(text.split())
-                    st.info(f"Extracted {char_count} characters ({word_count} words) from PDF")
-                    
-                    # Show text preview
-                    with st.expander("View extracted text preview"):
-                        st.text(text[:1000] + "..." if len(text) > 1000 else text)
-                    
-                    # Chunk the text
-                    chunks = chunk_text(text)
-                    st.info(f"Created {len(chunks)} text chunks")
+                # Restore the diagnostics saved with the index
+                pdf_analysis = cache_metadata.get("pdf_analysis")
+                if show_diagnostics and pdf_analysis:
+                    st.session_state.pdf_analysis = pdf_analysis
                     
-                    # Create embeddings
-                    with st.spinner("Creating embeddings..."):
-                        embeddings = create_embeddings()
-                    
-                    # Create vector store
-                    with st.spinner("Building vector database..."):
-                        vector_store = create_vector_store(chunks, embeddings)
-                        st.session_state.vector_store = vector_store
-                    
-                    # Set up conversation chain
-                    with st.spinner("Loading language model..."):
-                        st.session_state.conversation_chain = setup_conversational_chain(vector_store)
+                    # Sample images are cheap to re-extract from the first pages
+                    if pdf_analysis["has_images"] and not pdf_analysis["has_text"]:
+                        st.session_state.sample_images = extract_images_from_pdf(tmp_path, max_pages=2)
+                
+                with st.spinner("Loading language model..."):
+                    llm = load_llm()
+                    st.session_state.conversation_chain = setup_conversational_chain(vector_store, llm)
+                
+                st.session_state.processed = True
+                st.success("PDF processed successfully! You can now ask questions.")
+            else:
+                # Analyze the PDF, extract its text layer and sample images in one pass
+                with st.spinner("Analyzing PDF structure..."):
+                    text, pdf_analysis, sample_images = scan_pdf(tmp_path, max_pages=2)
+                
+                if show_diagnostics:
+                    st.session_state.pdf_analysis = pdf_analysis
                     
-                    st.session_state.processed = True
-                    st.success("PDF processed successfully! You can now ask questions.")
+                    # Keep sample images for problematic PDFs
+                    if pdf_analysis["has_images"] and not pdf_analysis["has_text"]:
+                        st.session_state.sample_images = sample_images
                 
-            except Exception as e:
-                st.error(f"Error processing PDF: {str(e)}")
+                # Process PDF
+                with st.spinner("Processing PDF..."):
+                    try:
+                        # Fall back to OCR when there is no usable text layer
+                        if not text.strip():
+                            text, ocr_methods = extract_text_with_ocr(tmp_path)
+                            st.session_state.ocr_used = bool(ocr_methods)
+                        
+                        if not text.strip():
+                            st.error("Could not extract text from PDF using any method.")
+                            st.info("This PDF may be: 1) Password protected 2) Pure images without text 3) Malformed")
+                            
+                            # Show manual workaround
+                            with st.expander("Manual Workaround Options"):
+                                st.markdown("""
+                                If automatic extraction fails, you can:
+                                1. **Convert PDF to text**: Use Adobe Acrobat or online tools
+                                2. **Copy text manually**: Select text and copy-paste
+                                3. **Use alternative OCR**: Try Google Drive or other OCR services
+                                4. **Check if PDF is protected**: Some PDFs restrict text extraction
+                                """)
+                        else:
+                            # Display text extraction stats
+                            char_count = len(text)
+                            word_count = len(text.split())
+                            st.info(f"Extracted {char_count} characters ({word_count} words) from PDF")
+                            
+                            # Show text preview
+                            with st.expander("View extracted text preview"):
+                                st.text(text[:1000] + "..." if len(text) > 1000 else text)
+                            
+                            # Chunk the text
+                            chunks = chunk_text(text)
+                            st.info(f"Created {len(chunks)} text chunks")
+                            
+                            # Create embeddings
+                            with st.spinner("Creating embeddings..."):
+                                embeddings = create_embeddings()
+                            
+                            # Create vector store
+                            with st.spinner("Building vector database..."):
+                                vector_store = create_vector_store(chunks, embeddings)
+                                st.session_state.vector_store = vector_store
+                                save_vector_store(vector_store, pdf_key, {
+                                    "pdf_analysis": pdf_analysis,
+                                    "ocr_used": st.session_state.ocr_used
+                                })
+                            
+                            # Set up conversation chain (the LLM itself is cached across reruns)
+                            with st.spinner("Loading language model..."):
+                                llm = load_llm()
+                                st.session_state.conversation_chain = setup_conversational_chain(vector_store, llm)
+                            
+                            st.session_state.processed = True
+                            st.success("PDF processed successfully! You can now ask questions.")
+                        
+                    except Exception as e:
+                        st.error(f"Error processing PDF: {str(e)}")
+        except Exception as e:
+            st.error(f"Error processing PDF: {str(e)}")
+        finally:
+            # Clean up temporary file
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     
     st.markdown("---")
     st.markdown("### About")
@@ -174,19 +227,38 @@ if prompt := st.chat_input("Ask a question about your PDF..."):
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 try:
-                    # Get response from the chain
-                    response = st.session_state.conversation_chain({"question": prompt})
-                    answer = response["answer"]
+                    chain = st.session_state.conversation_chain
+                    
+                    # The answer depends only on the standalone question the chain
+                    # condenses from the conversation, so that is the cache key
+                    standalone_question = condense_question(chain, prompt)
+                    
+                    # Check the semantic cache before retrieving and generating
+                    query_embedding = create_embeddings().embed_query(standalone_question)
+                    cached = lookup_answer(st.session_state.qa_cache, query_embedding)
+                    
+                    if cached is not None:
+                        answer, source_documents = cached
+                        # Keep the conversation memory in sync with the chat
+                        chain.memory.save_context(
+                            {"question": prompt}, {"answer": answer}
+                        )
+                    else:
+                        # Get response from the chain
+                        answer, source_documents = answer_question(chain, prompt, standalone_question)
+                        store_answer(st.session_state.qa_cache, query_embedding, (answer, source_documents))
                     
                     # Display assistant response
                     st.markdown(answer)
+                    if cached is not None:
+                        st.caption("Answer reused from a similar earlier question")
 
                     # Add assistant response to chat history
                     st.session_state.chat_history.append({"role": "assistant", "content": answer})
                     
                     # Show source documents (optional)
                     with st.expander("Source Documents"):
-                        for i, doc in enumerate(response["source_documents"]):
+                        for i, doc in enumerate(source_documents):
                             st.markdown(f"**Source {i+1}:**")
                             st.text(doc.page_content[:500] + "..." if len(doc.page_content) > 500 else doc.page_content)
                             st.markdown("---")
@@ -214,7 +286,9 @@ if not st.session_state.processed and uploaded_file:
                 st.session_state.vector_store = vector_store
                 
                 # Set up conversation chain
-                st.session_state.conversation_chain = setup_conversational_chain(vector_store)
+                llm = load_llm()
+                st.session_state.conversation_chain = setup_conversational_chain(vector_store, llm)
+                st.session_state.qa_cache = create_qa_cache()
                 
                 st.session_state.processed = True
                 st.success("Manual text processed successfully!")
@@ -227,6 +301,7 @@ if not st.session_state.processed and uploaded_file:
 if st.session_state.chat_history:
     if st.button("Clear Chat"):
         st.session_state.chat_history = []
+        st.session_state.qa_cache = create_qa_cache()
         if st.session_state.conversation_chain:
             st.session_state.conversation_chain.memory.clear()
         st.rerun()
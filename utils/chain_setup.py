@@ -1,47 +1,77 @@
+import streamlit as st
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
 from langchain.memory import ConversationBufferMemory
-from langchain_community.llms import CTransformers
+from langchain_community.llms import LlamaCpp
+from huggingface_hub import hf_hub_download
 import os
+import threading
 
-def setup_conversational_chain(vector_store):
+# Model configuration - GGUF Q4_K_M quantization runs on llama.cpp's optimized CPU kernels
+MODEL_CONFIG = {
+    "repo_id": "TheBloke/Llama-2-7B-Chat-GGUF",
+    "model_file": "llama-2-7b-chat.Q4_K_M.gguf",
+    "max_tokens": 512,
+    "temperature": 0.7,
+    "n_ctx": 2048,  # Reduced for stability
+    "n_batch": 512,  # Prompt tokens evaluated per batch
+    "n_gpu_layers": 0  # CPU only
+}
+
+# The cached LLM is shared by every session's script thread, and a llama.cpp
+# context must not decode two requests at once
+_llm_lock = threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def _load_llm(config_items):
     """
-    Set up the conversational chain with local LLM
+    Load the local LLM once per process, keyed on the model configuration
     """
-    # Model configuration - using a smaller model for better compatibility
-    model_config = {
-        "model": "TheBloke/Llama-2-7B-Chat-GGML",  # Using GGML format for wider compatibility
-        "model_file": "llama-2-7b-chat.ggmlv3.q4_0.bin",
-        "model_type": "llama",
-        "max_new_tokens": 512, 
-        "temperature": 0.7,
-        "context_length": 2048,  # Reduced for stability
-        "gpu_layers": 0  # CPU only
-    }
+    model_config = dict(config_items)
     
     # Initialize local LLM
     try:
-        llm = CTransformers(
-            model=model_config["model"],
-            model_file=model_config["model_file"],
-            model_type=model_config["model_type"],
-            config={
-                'max_new_tokens': model_config["max_new_tokens"],
-                'temperature': model_config["temperature"],
-                'context_length': model_config["context_length"],
-                'gpu_layers': model_config["gpu_layers"]
-            }
+        llm = LlamaCpp(
+            model_path=hf_hub_download(model_config["repo_id"], model_config["model_file"]),
+            max_tokens=model_config["max_tokens"],
+            temperature=model_config["temperature"],
+            n_ctx=model_config["n_ctx"],
+            n_batch=model_config["n_batch"],
+            n_gpu_layers=model_config["n_gpu_layers"],
+            n_threads=os.cpu_count(),
+            verbose=False
         )
     except Exception as e:
         print(f"Error loading model: {e}")
         # Fallback to a smaller model if the main one fails
-        llm = CTransformers(
-            model="TheBloke/TinyLlama-1.1B-Chat-v1.0-GGML",
-            model_file="tinyllama-1.1b-chat-v1.0.Q4_K_M.ggml",
-            model_type="llama",
-            config={'max_new_tokens': 256, 'temperature': 0.7}
+        llm = LlamaCpp(
+            model_path=hf_hub_download(
+                "TheBloke/TinyLlama-1.1B-Chat-v1.0-GGUF",
+                "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf"
+            ),
+            max_tokens=256,
+            temperature=0.7,
+            n_threads=os.cpu_count(),
+            verbose=False
         )
     
-    # Set up memory for conversation history
+    return llm
+
+def load_llm(model_config=None):
+    """
+    Return the cached local LLM for the given configuration
+    """
+    model_config = model_config or MODEL_CONFIG
+    return _load_llm(tuple(sorted(model_config.items())))
+
+def setup_conversational_chain(vector_store, llm=None):
+    """
+    Set up the conversational chain with local LLM
+    """
+    if llm is None:
+        llm = load_llm()
+    
+    # Set up memory for conversation history (per chain, never cached)
     memory = ConversationBufferMemory(
         memory_key="chat_history",
         return_messages=True,
@@ -58,4 +88,30 @@ def setup_conversational_chain(vector_store):
         output_key='answer'
     )
     
-    return chain
\ No newline at end of file
+    return chain
+
+def condense_question(chain, question):
+    """
+    Rewrite a follow-up into a standalone question using the chain's memory
+    """
+    chat_history = chain.memory.load_memory_variables({})["chat_history"]
+    chat_history_str = (chain.get_chat_history or _get_chat_history)(chat_history)
+    
+    # The first question of a conversation is already standalone
+    if not chat_history_str:
+        return question
+    
+    with _llm_lock:
+        return chain.question_generator.run(question=question, chat_history=chat_history_str)
+
+def answer_question(chain, question, standalone_question):
+    """
+    Answer an already condensed question with the chain's retriever and LLM, recording the turn in memory
+    """
+    # Same steps as the chain itself, minus condensing the question a second time
+    source_documents = chain.retriever.get_relevant_documents(standalone_question)
+    with _llm_lock:
+        answer = chain.combine_docs_chain.run(input_documents=source_documents, question=standalone_question)
+    chain.memory.save_context({"question": question}, {"answer": answer})
+    
+    return answer, source_documents
\ No newline at end of file
@@ -1,22 +1,154 @@
-from langchain.embeddings import HuggingFaceEmbeddings
+import streamlit as st
 from langchain.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.embeddings import Embeddings
+import numpy as np
+import faiss
 import os
+import shutil
+import hashlib
+import json
+import re
+from pathlib import Path
 
+# all-MiniLM-L6-v2 output size
+EMBEDDING_DIMENSION = 384
+
+# int8-quantized ONNX export of the embedding model (see README), used on CPU when present
+ONNX_MODEL_PATH = os.environ.get(
+    "EMBEDDINGS_ONNX_MODEL", "models/all-MiniLM-L6-v2-int8/model_quantized.onnx"
+)
+
+# HNSW graph parameters: neighbours per node, build-time and query-time beam width
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Chunks embedded and added to the index per batch, bounding peak memory
+INDEX_BATCH_SIZE = 512
+
+# On-disk vector store cache inside the app's own directory, keyed by the SHA-256 of the source PDF
+INDEX_CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache" / "indexes"
+INDEX_CACHE_SIZE = 10  # Most recently used indexes kept
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Mean-pooled, normalized sentence embeddings from a quantized ONNX model
+    """
+    
+    def __init__(self, model_path, model_name, batch_size=128, max_length=256):
+        # Heavy imports are deferred until an encoder is actually built
+        import onnxruntime
+        from transformers import AutoTokenizer
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.batch_size = batch_size
+        self.max_length = max_length
+        # Identifies the vector space for the on-disk index cache
+        self.cache_id = f"onnx:{model_name}:{os.path.basename(model_path)}"
+    
+    def _embed_batch(self, texts):
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+        
+        # Mean pooling over real (non-padding) tokens, then L2 normalization
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    
+    def embed_documents(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return embeddings
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class TransformerEmbeddings(Embeddings):
+    """
+    Mean-pooled, normalized sentence embeddings from a Hugging Face encoder
+    """
+    
+    def __init__(self, model_name, device="cpu", batch_size=128, max_length=256):
+        # Heavy imports are deferred until an encoder is actually built
+        from transformers import AutoTokenizer, AutoModel
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        self.model = AutoModel.from_pretrained(model_name).to(device).eval()
+        self.device = device
+        self.batch_size = batch_size
+        self.max_length = max_length
+        # Identifies the vector space for the on-disk index cache
+        self.cache_id = f"transformers:{model_name}"
+    
+    def embed_documents(self, texts):
+        import torch
+        import torch.nn.functional as F
+        
+        # Tokenize every text in one pass of the Rust tokenizer
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt"
+        )
+        
+        embeddings = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                mask = encoded["attention_mask"][start:start + self.batch_size]
+                # Trim columns that are padding for every row of this batch
+                length = int(mask.sum(dim=1).max())
+                batch = {
+                    name: tensor[start:start + self.batch_size, :length].to(self.device)
+                    for name, tensor in encoded.items()
+                }
+                token_embeddings = self.model(**batch).last_hidden_state
+                
+                # Mean pooling over real (non-padding) tokens, then L2 normalization
+                mask = batch["attention_mask"].unsqueeze(-1).to(token_embeddings.dtype)
+                pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                embeddings.extend(F.normalize(pooled, dim=1).cpu().numpy().tolist())
+        
+        return embeddings
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+@st.cache_resource(show_spinner=False)
 def create_embeddings():
     """
-    Initialize local sentence transformer embeddings
+    Initialize local sentence transformer embeddings (loaded once per process)
     """
     model_name = "sentence-transformers/all-MiniLM-L6-v2"
-    model_kwargs = {'device': 'cpu'}
-    encode_kwargs = {'normalize_embeddings': False}
     
-    embeddings = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs
-    )
+    # The int8 ONNX export is only generated for CPU hosts; it needs neither torch nor a GPU check
+    if os.path.exists(ONNX_MODEL_PATH):
+        return OnnxEmbeddings(ONNX_MODEL_PATH, model_name)
     
-    return embeddings
+    try:
+        import torch
+    except ImportError:
+        raise ImportError("PyTorch is required for the embedding model unless the ONNX export is present (see README)")
+    
+    # The small encoder fits on any GPU; the LLM stays on CPU as configured
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    
+    # Normalized embeddings make cosine similarity a dot product
+    return TransformerEmbeddings(model_name, device=device)
 
 def create_vector_store(chunks, embeddings):
     """
@@ -26,5 +158,90 @@ def create_vector_store(chunks, embeddings):
     if not chunks:
         raise ValueError("No text chunks available for creating vector store.")
     
-    vector_store = FAISS.from_documents(chunks, embeddings)
-    return vector_store
\ No newline at end of file
+    # Drop exact duplicates (repeated headers, footers, TOCs) before embedding
+    seen = set()
+    unique_chunks = []
+    for chunk in chunks:
+        key = hashlib.blake2b(chunk.page_content.strip().lower().encode(), digest_size=16).digest()
+        if key not in seen:
+            seen.add(key)
+            unique_chunks.append(chunk)
+    print(f"Skipped {len(chunks) - len(unique_chunks)} duplicate chunks")
+    chunks = unique_chunks
+    
+    # HNSW graph for sublinear search; embeddings are normalized, so inner product is cosine
+    index = faiss.IndexHNSWFlat(EMBEDDING_DIMENSION, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    
+    vector_store = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+    )
+    
+    # Embed and add in batches so only one batch of vectors is alive at a time
+    for start in range(0, len(chunks), INDEX_BATCH_SIZE):
+        vector_store.add_documents(chunks[start:start + INDEX_BATCH_SIZE])
+    
+    return vector_store
+
+def _index_cache_path(key, embeddings):
+    """
+    Cache directory for a document key, separate per embedding backend and model
+    """
+    cache_id = getattr(embeddings, "cache_id", type(embeddings).__name__)
+    return INDEX_CACHE_DIR / hashlib.sha256(f"{key}:{cache_id}".encode()).hexdigest()
+
+def load_cached_vector_store(key, embeddings):
+    """
+    Load a previously saved vector store and its metadata for this key, or return (None, None)
+    """
+    path = _index_cache_path(key, embeddings)
+    if not (path / "index.faiss").exists():
+        return None, None
+    
+    try:
+        # The pickled docstore was written by save_vector_store, so it is trusted
+        vector_store = FAISS.load_local(
+            str(path),
+            embeddings,
+            allow_dangerous_deserialization=True,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        vector_store.index.hnsw.efSearch = HNSW_EF_SEARCH
+        
+        metadata_path = path / "metadata.json"
+        metadata = json.loads(metadata_path.read_text()) if metadata_path.exists() else {}
+    except Exception as e:
+        print(f"Error loading cached index: {e}")
+        return None, None
+    
+    # Mark as recently used for eviction
+    os.utime(path)
+    return vector_store, metadata
+
+def save_vector_store(vector_store, key, metadata=None):
+    """
+    Save a vector store and its metadata under this key, evicting the least recently used ones
+    """
+    try:
+        path = _index_cache_path(key, vector_store.embedding_function)
+        vector_store.save_local(str(path))
+        (path / "metadata.json").write_text(json.dumps(metadata or {}))
+        
+        # Only consider entries written by save_vector_store
+        cached = sorted(
+            (
+                path for path in INDEX_CACHE_DIR.iterdir()
+                if re.fullmatch(r"[0-9a-f]{64}", path.name) and (path / "index.faiss").exists()
+            ),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        )
+        for path in cached[INDEX_CACHE_SIZE:]:
+            shutil.rmtree(path, ignore_errors=True)
+    except Exception as e:
+        print(f"Error saving index to cache: {e}")
\ No newline at end of file
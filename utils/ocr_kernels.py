@@ -0,0 +1,35 @@
+from numba import njit, prange
+
+@njit(cache=True)
+def _reflect_101(index, size):
+    """
+    Map an out-of-range index like OpenCV's default BORDER_REFLECT_101
+    """
+    if size == 1:
+        return 0
+    if index < 0:
+        return -index
+    if index >= size:
+        return 2 * size - 2 - index
+    return index
+
+@njit(parallel=True, fastmath=True, cache=True)
+def sharpen_threshold(img_u8, threshold, out):
+    """
+    Binary threshold and 3x3 sharpen fused into a single pass over the image
+    """
+    height, width = img_u8.shape
+    for y in prange(height):
+        for x in range(width):
+            total = 0
+            for dy in range(-1, 2):
+                yy = _reflect_101(y + dy, height)
+                for dx in range(-1, 2):
+                    xx = _reflect_101(x + dx, width)
+                    value = 255 if img_u8[yy, xx] > threshold else 0
+                    if dy == 0 and dx == 0:
+                        total += 9 * value
+                    else:
+                        total -= value
+            # Saturate like cv2.filter2D does for uint8 output
+            out[y, x] = min(max(total, 0), 255)
\ No newline at end of file
@@ -1,21 +1,21 @@
-import PyPDF2
-import pdfplumber
 import fitz  # PyMuPDF
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
-import tempfile
 import os
-from pdf2image import convert_from_path
-import pytesseract
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-import cv2
-import numpy as np
-import io
+from utils.pdf_diagnostic import describe_pdf_analysis, extract_page_image
 
 def preprocess_image_for_ocr(image):
     """
     Enhanced image preprocessing for better OCR results
     """
+    # Heavy imports are deferred until OCR is actually needed
+    import cv2
+    import numpy as np
+    from utils.ocr_kernels import sharpen_threshold
+    
     try:
         # Convert PIL Image to OpenCV format
         img = np.array(image)
@@ -28,196 +28,397 @@ def preprocess_image_for_ocr(image):
         # 1. Noise reduction
         img = cv2.medianBlur(img, 3)
         
-        # 2. Thresholding
-        _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # 3. Morphological operations to clean up text
-        kernel = np.ones((1, 1), np.uint8)
-        img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel)
+        # 2. Otsu threshold value (the binarization itself is fused with sharpening)
+        threshold, _ = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         
-        # 4. Sharpening
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        img = cv2.filter2D(img, -1, kernel)
+        # 3. Thresholding + sharpening in one JIT-compiled pass
+        sharpened = np.empty_like(img)
+        sharpen_threshold(np.ascontiguousarray(img), threshold, sharpened)
         
-        return Image.fromarray(img)
+        return Image.fromarray(sharpened)
     except Exception as e:
         print(f"Image preprocessing failed: {e}")
         return image
 
-def extract_text_with_enhanced_ocr(pdf_path, dpi=300):
+# Worker processes used to rasterize PDF pages
+RENDER_WORKERS = os.cpu_count() or 1
+
+# Lowest DPI used when matching a page's native scan resolution, and the DPI bucket size
+MIN_RENDER_DPI = 150
+RENDER_DPI_STEP = 25
+
+# Fraction of the page an image must cover to count as the page's scan
+MIN_SCAN_COVERAGE = 0.5
+
+def _render_pages(pdf_path, first_page, last_page, dpi):
+    """
+    Rasterize a 1-based inclusive page range (runs in a worker process)
+    """
+    from pdf2image import convert_from_path
+    
+    return convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+
+def _page_ranges(pages, parts):
     """
-    Enhanced OCR extraction with multiple strategies
+    Group sorted 0-based page indices into at most ~parts contiguous 1-based ranges
+    """
+    size = max(1, -(-len(pages) // parts))
+    ranges = []
+    for page in pages:
+        page_number = page + 1
+        if ranges and page_number == ranges[-1][1] + 1 and ranges[-1][1] - ranges[-1][0] + 1 < size:
+            ranges[-1][1] = page_number
+        else:
+            ranges.append([page_number, page_number])
+    return ranges
+
+def _page_render_dpi(page, dpi):
     """
-    text = ""
+    Pick a render DPI no higher than twice the resolution of the page's scanned image
+    """
+    # Only an image covering most of the page is a scan; logos and figures
+    # say nothing about the size of the page's text, so those pages keep the requested DPI
+    page_area = abs(page.rect)
+    native_dpi = None
+    for img in page.get_images():
+        xref, width, height = img[0], img[2], img[3]
+        for rect in page.get_image_rects(xref):
+            if rect.is_empty or abs(rect) < MIN_SCAN_COVERAGE * page_area:
+                continue
+            # Resolution of the image as placed on the page
+            image_dpi = max(width / rect.width, height / rect.height) * 72
+            native_dpi = max(native_dpi or 0, image_dpi)
+    
+    if native_dpi is None:
+        return dpi
+    
+    page_dpi = min(dpi, max(MIN_RENDER_DPI, 2 * native_dpi))
+    
+    # Bucket the DPI so neighbouring pages share render ranges
+    return min(dpi, int(round(page_dpi / RENDER_DPI_STEP) * RENDER_DPI_STEP))
+
+def render_pdf_pages(pdf_path, dpi=300, pages=None, adaptive=True):
+    """
+    Rasterize PDF pages (all, or the given 0-based indices) across worker processes
+    """
+    with fitz.open(pdf_path) as doc:
+        if pages is None:
+            pages = list(range(len(doc)))
+        page_dpis = {
+            page: _page_render_dpi(doc[page], dpi) if adaptive else dpi
+            for page in pages
+        }
+    
+    # Contiguous page ranges per DPI bucket, spread over the workers
+    jobs = []
+    for page_dpi in sorted(set(page_dpis.values())):
+        group = sorted(page for page in pages if page_dpis[page] == page_dpi)
+        jobs.extend((first, last, page_dpi) for first, last in _page_ranges(group, RENDER_WORKERS))
+    
+    if len(jobs) <= 1:
+        rendered = [_render_pages(pdf_path, first, last, page_dpi) for first, last, page_dpi in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(RENDER_WORKERS, len(jobs))) as executor:
+            futures = [executor.submit(_render_pages, pdf_path, *job) for job in jobs]
+            rendered = [future.result() for future in futures]
+    
+    images = {}
+    for (first, last, _), range_images in zip(jobs, rendered):
+        images.update(zip(range(first - 1, last), range_images))
+    return [images[page] for page in pages]
+
+# Maximum number of concurrent Tesseract processes
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", os.cpu_count() or 1))
+
+# Pages with less text than this move on to the next OCR fallback
+MIN_PAGE_TEXT_LENGTH = 50
+
+# Tesseract page segmentation modes (tesserocr.PSM values)
+PSM_AUTO = 3  # Fully automatic page segmentation
+PSM_SINGLE_BLOCK = 6  # Assume a uniform block of text
+
+# Page segmentation modes tried on the preprocessed image, in order
+OCR_FALLBACK_PSMS = [
+    PSM_SINGLE_BLOCK,
+    4,  # Assume single column of text
+    8,  # Single word
+]
+
+# Long-lived Tesseract API of the current OCR worker process
+_tesseract_api = None
+
+def _init_tesseract_worker(lang):
+    """
+    Create one Tesseract API per worker process, reused for every page it handles
+    """
+    # Parallelism comes from the process pool; single-threaded Tesseract (OpenMP) and
+    # Numba kernels avoid oversubscribing the cores. Both are read when the libraries load.
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    os.environ["NUMBA_NUM_THREADS"] = "1"
+    if "numba" in sys.modules:
+        # Already loaded in the parent before the fork
+        sys.modules["numba"].set_num_threads(1)
+    
+    import tesserocr
+    
+    global _tesseract_api
+    _tesseract_api = tesserocr.PyTessBaseAPI(lang=lang, oem=tesserocr.OEM.DEFAULT)
+
+def _ocr_image(image, psm):
+    """
+    Run a single in-process Tesseract recognition with the worker's API
+    """
+    try:
+        _tesseract_api.SetPageSegMode(psm)
+        _tesseract_api.SetImage(image)
+        return _tesseract_api.GetUTF8Text()
+    except Exception:
+        return ""
+
+def _ocr_page(image):
+    """
+    OCR one page, only falling back to preprocessing and other modes when needed
+    """
+    # Most pages succeed on the raw image with the default mode
+    page_text = _ocr_image(image, PSM_SINGLE_BLOCK)
+    if len(page_text.strip()) >= MIN_PAGE_TEXT_LENGTH:
+        return page_text
+    
+    # Preprocess once and reuse the image for all fallbacks
+    processed = preprocess_image_for_ocr(image)
+    
+    for psm in OCR_FALLBACK_PSMS:
+        fallback_text = _ocr_image(processed, psm)
+        if len(fallback_text.strip()) > len(page_text.strip()):
+            page_text = fallback_text
+        if len(page_text.strip()) >= MIN_PAGE_TEXT_LENGTH:
+            break
+    
+    return page_text
+
+def _ocr_page_simple(image):
+    """
+    Single OCR pass with automatic page segmentation
+    """
+    return _ocr_image(image, PSM_AUTO)
+
+def _ocr_pages(images, ocr_page=_ocr_page, lang='eng'):
+    """
+    OCR pages in parallel worker processes, each holding its own Tesseract API
+    """
+    if not images:
+        return []
+    
+    # The Tesseract API is not thread-safe, so parallelism comes from processes
+    with ProcessPoolExecutor(
+        max_workers=min(OCR_CONCURRENCY, len(images)),
+        initializer=_init_tesseract_worker,
+        initargs=(lang,)
+    ) as executor:
+        return list(executor.map(ocr_page, images))
+
+def extract_text_with_enhanced_ocr(pdf_path, dpi=300, pages=None, images=None, adaptive=True):
+    """
+    Enhanced OCR extraction with multiple strategies, one result per page (None where it failed)
+    """
+    page_texts = []
     
     try:
-        # Convert PDF to images
-        images = convert_from_path(pdf_path, dpi=dpi, thread_count=4)
+        # Convert PDF to images unless already rendered by the caller
+        if images is None:
+            images = render_pdf_pages(pdf_path, dpi=dpi, pages=pages, adaptive=adaptive)
+        print(f"Processing {len(images)} pages with OCR...")
         
-        for i, image in enumerate(images):
-            print(f"Processing page {i+1}/{len(images)} with OCR...")
-            
-            # Try multiple preprocessing strategies
-            strategies = [
-                lambda img: img,  # Original image
-                lambda img: preprocess_image_for_ocr(img),  # Standard preprocessing
-            ]
-            
-            page_text = ""
-            for strategy_idx, strategy in enumerate(strategies):
-                try:
-                    processed_image = strategy(image)
-                    
-                    # Try different OCR configurations
-                    ocr_configs = [
-                        '--oem 3 --psm 6',  # Default
-                        '--oem 3 --psm 4',  # Assume single column of text
-                        '--oem 3 --psm 8',  # Single word
-                        '--oem 1 --psm 6',  # Legacy engine
-                    ]
-                    
-                    for config in ocr_configs:
-                        try:
-                            strategy_text = pytesseract.image_to_string(
-                                processed_image, 
-                                lang='eng', 
-                                config=config
-                            )
-                            
-                            if strategy_text and len(strategy_text.strip()) > len(page_text.strip()):
-                                page_text = strategy_text
-                        except:
-                            continue
-                            
-                except Exception as e:
-                    print(f"OCR strategy {strategy_idx} failed: {e}")
-                    continue
-            
-            if page_text.strip():
-                text += f"--- Page {i+1} ---\n{page_text}\n\n"
-            else:
-                print(f"Warning: No text extracted from page {i+1}")
+        page_texts = _ocr_pages(images)
     
     except Exception as e:
         print(f"Enhanced OCR extraction failed: {e}")
         # Fallback to simple OCR
+        page_texts = []
         try:
-            images = convert_from_path(pdf_path, dpi=200)
-            for i, image in enumerate(images):
-                page_text = pytesseract.image_to_string(image, lang='eng')
-                if page_text.strip():
-                    text += f"--- Page {i+1} ---\n{page_text}\n\n"
+            if images is None:
+                images = render_pdf_pages(pdf_path, dpi=200, pages=pages)
+            page_texts = _ocr_pages(images, _ocr_page_simple)
         except:
             pass
     
-    return text
+    page_numbers = pages if pages is not None else range(len(page_texts))
+    for page, page_text in zip(page_numbers, page_texts):
+        if not page_text.strip():
+            print(f"Warning: No text extracted from page {page+1}")
+    
+    return [page_text if page_text.strip() else None for page_text in page_texts]
 
-def try_direct_text_extraction(pdf_path):
+def _extract_text_with_pdfplumber(pdf_path):
     """
-    Try all direct text extraction methods
+    Direct text extraction with pdfplumber
     """
-    text = ""
-    methods = []
+    parts = []
+    try:
+        import pdfplumber
+        
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages:
+                page_text = page.extract_text()
+                if page_text and page_text.strip():
+                    parts.append(page_text)
+    except:
+        pass
     
-    # Method 1: PyMuPDF (most reliable)
+    return "\n".join(parts)
+
+def _extract_text_with_pypdf2(pdf_path):
+    """
+    Direct text extraction with PyPDF2
+    """
+    parts = []
     try:
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                page_text = page.get_text()
+        import PyPDF2
+        
+        with open(pdf_path, 'rb') as f:
+            pdf_reader = PyPDF2.PdfReader(f)
+            for page in pdf_reader.pages:
+                page_text = page.extract_text()
                 if page_text and page_text.strip():
-                    text += page_text + "\n"
-                    methods.append("PyMuPDF")
+                    parts.append(page_text)
     except:
         pass
     
-    # Method 2: pdfplumber
-    if not text.strip():
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text and page_text.strip():
-                        text += page_text + "\n"
-                        methods.append("pdfplumber")
-        except:
-            pass
+    return "\n".join(parts)
+
+def scan_pdf(pdf_path, max_pages=2):
+    """
+    Extract text, structure analysis and sample images in a single pass
+    """
+    parts = []
+    sample_images = []
+    analysis = {
+        "has_text": False,
+        "has_images": False,
+        "page_count": 0,
+        "file_size": 0,
+        "is_encrypted": False,
+        "analysis": ""
+    }
+    
+    try:
+        analysis["file_size"] = os.path.getsize(pdf_path)
+        
+        with fitz.open(pdf_path) as doc:
+            analysis["page_count"] = len(doc)
+            analysis["is_encrypted"] = doc.is_encrypted
+            
+            for page_num, page in enumerate(doc):
+                # Check for text
+                page_text = page.get_text()
+                if page_text and page_text.strip():
+                    parts.append(page_text)
+                    analysis["has_text"] = True
+                
+                # Past the sample pages, image presence is all that is needed
+                if analysis["has_images"] and page_num >= max_pages:
+                    continue
+                
+                # Check for images, keeping the first one of early pages as a sample
+                image_list = page.get_images()
+                if image_list:
+                    analysis["has_images"] = True
+                    if page_num < max_pages:
+                        try:
+                            sample_images.append((page_num, 0, extract_page_image(doc, image_list)))
+                        except Exception as e:
+                            print(f"Error extracting images: {e}")
+            
+            analysis["analysis"] = describe_pdf_analysis(analysis)
     
-    # Method 3: PyPDF2
+    except Exception as e:
+        analysis["analysis"] = f"Error analyzing PDF: {str(e)}"
+    
+    text = "\n".join(parts)
+    
+    # Only fall back to the slower parsers if PyMuPDF found no text
     if not text.strip():
-        try:
-            with open(pdf_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text and page_text.strip():
-                        text += page_text + "\n"
-                        methods.append("PyPDF2")
-        except:
-            pass
+        text = _extract_text_with_pdfplumber(pdf_path)
+    if not text.strip():
+        text = _extract_text_with_pypdf2(pdf_path)
     
-    return text, methods
+    return text, analysis, sample_images
 
-def extract_text_from_pdf(pdf_file):
+def extract_text_with_ocr(pdf_path):
     """
-    Comprehensive text extraction with multiple fallbacks
+    OCR extraction with increasingly expensive fallbacks for the pages that still lack text
     """
-    # Save uploaded file to temporary location
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        tmp_file.write(pdf_file.read())
-        tmp_path = tmp_file.name
-    
-    text = ""
+    results = []
     methods_used = []
     
     try:
-        # First try direct text extraction
-        text, direct_methods = try_direct_text_extraction(tmp_path)
-        methods_used.extend(direct_methods)
+        with fitz.open(pdf_path) as doc:
+            results = [None] * len(doc)
+        all_pages = list(range(len(results)))
         
-        # If direct methods failed, try OCR
-        if not text.strip():
-            print("Direct extraction failed, trying OCR...")
-            text = extract_text_with_enhanced_ocr(tmp_path, dpi=300)
-            if text.strip():
-                methods_used.append("OCR")
+        # Render every page once and reuse the images for the fallback passes
+        try:
+            images = render_pdf_pages(pdf_path, dpi=300, pages=all_pages)
+        except Exception as e:
+            print(f"Page rendering failed: {e}")
+            images = None
         
-        # If still no text, try extreme measures
-        if not text.strip():
-            print("All methods failed, trying extreme measures...")
-            
-            # Try with higher DPI
-            text = extract_text_with_enhanced_ocr(tmp_path, dpi=400)
-            if text.strip():
+        page_texts = extract_text_with_enhanced_ocr(pdf_path, dpi=300, pages=all_pages, images=images)
+        for page, page_text in zip(all_pages, page_texts):
+            results[page] = page_text
+        if any(results):
+            methods_used.append("OCR")
+        
+        # Retry only the failed pages at a higher DPI
+        failed = [page for page, page_text in enumerate(results) if not page_text]
+        if failed:
+            print(f"OCR failed on {len(failed)} pages, retrying them at higher DPI...")
+            # Native-resolution capping is skipped here; the point is to try more pixels
+            page_texts = extract_text_with_enhanced_ocr(pdf_path, dpi=400, pages=failed, adaptive=False)
+            for page, page_text in zip(failed, page_texts):
+                results[page] = page_text
+            if any(results[page] for page in failed):
                 methods_used.append("High-DPI OCR")
-            
-            # Try different languages
-            if not text.strip():
-                try:
-                    images = convert_from_path(tmp_path, dpi=300)
-                    for i, image in enumerate(images):
-                        try:
-                            page_text = pytesseract.image_to_string(image, lang='eng+fra+deu+spa')
-                            if page_text.strip():
-                                text += f"--- Page {i+1} ---\n{page_text}\n\n"
-                                methods_used.append("Multi-language OCR")
-                        except:
-                            pass
-                except:
-                    pass
+        
+        # Try different languages on the pages that are still empty
+        failed = [page for page, page_text in enumerate(results) if not page_text]
+        if failed:
+            try:
+                if images is not None:
+                    failed_images = [images[page] for page in failed]
+                else:
+                    failed_images = render_pdf_pages(pdf_path, dpi=300, pages=failed)
+                page_texts = _ocr_pages(failed_images, _ocr_page_simple, lang='eng+fra+deu+spa')
+                for page, page_text in zip(failed, page_texts):
+                    if page_text.strip():
+                        results[page] = page_text
+                if any(results[page] for page in failed):
+                    methods_used.append("Multi-language OCR")
+            except:
+                pass
     
     except Exception as e:
-        print(f"Comprehensive extraction failed: {e}")
-    finally:
-        # Clean up temporary file
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
-    
-    print(f"Extraction methods used: {methods_used}")
-    print(f"Extracted text length: {len(text)}")
+        print(f"OCR extraction failed: {e}")
     
-    return text
+    text = "".join(
+        f"--- Page {page+1} ---\n{page_text}\n\n"
+        for page, page_text in enumerate(results) if page_text
+    )
+    return text, methods_used
 
-def chunk_text(text, chunk_size=800, chunk_overlap=150):
+# Default chunking parameters and the splitter built once for them
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+CHUNK_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    separators=CHUNK_SEPARATORS
+)
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
     """
     Split text into chunks for processing with better handling
     """
@@ -228,12 +429,16 @@ def chunk_text(text, chunk_size=800, chunk_overlap=150):
     # Clean up text
     text = text.strip()
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    # Reuse the shared splitter unless non-default sizes were requested
+    if chunk_size == CHUNK_SIZE and chunk_overlap == CHUNK_OVERLAP:
+        text_splitter = _SPLITTER
+    else:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            separators=CHUNK_SEPARATORS
+        )
     
     # Create documents for LangChain
     documents = [Document(page_content=text)]
@@ -0,0 +1,47 @@
+import numpy as np
+
+# Cosine similarity above which a previous answer is reused
+SIMILARITY_THRESHOLD = 0.95
+# Maximum number of cached question/answer pairs (least recently used evicted first)
+MAX_CACHE_SIZE = 256
+
+def create_qa_cache(dimension=384):
+    """
+    Create an empty semantic cache of question embeddings and their answers
+    """
+    return {
+        "embeddings": np.empty((0, dimension), dtype=np.float32),
+        "entries": []
+    }
+
+def lookup_answer(cache, query_embedding, threshold=SIMILARITY_THRESHOLD):
+    """
+    Return the cached entry for the most similar previous question, or None
+    """
+    if not cache["entries"]:
+        return None
+    
+    # Embeddings are normalized, so cosine similarity is a plain dot product
+    query = np.asarray(query_embedding, dtype=np.float32)
+    similarities = cache["embeddings"] @ query
+    best = int(np.argmax(similarities))
+    
+    if similarities[best] <= threshold:
+        return None
+    
+    # Move the hit to the most recently used position
+    hit = cache["embeddings"][best:best + 1]
+    cache["embeddings"] = np.concatenate([np.delete(cache["embeddings"], best, axis=0), hit])
+    entry = cache["entries"].pop(best)
+    cache["entries"].append(entry)
+    
+    return entry
+
+def store_answer(cache, query_embedding, entry, max_size=MAX_CACHE_SIZE):
+    """
+    Add a question embedding and its entry, evicting the least recently used
+    """
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    cache["embeddings"] = np.concatenate([cache["embeddings"], query])[-max_size:]
+    cache["entries"].append(entry)
+    del cache["entries"][:-max_size]
\ No newline at end of file